@@ -907,11 +907,18 @@ class EC2State(MachineState[EC2Definition], EC2CommonState):
             time.sleep(3)
         self.log_end("")
 
-        instance = self._retry(
-            lambda: self._get_instance(instance_id=request.instance_id)
-        )
+        # The fulfilled instance may not be visible to DescribeInstances yet.
+        def check_visible():
+            instance = self._retry(
+                lambda: self._get_instance(
+                    instance_id=request.instance_id, allow_missing=True
+                )
+            )
+            return instance is not None
 
-        return instance
+        nixops.util.check_wait(check_visible, initial=3, max_tries=20)
+
+        return self._get_instance(instance_id=request.instance_id)
 
     def create_instance(self, defn, zone, user_data, ebs_optimized, args):
         IamInstanceProfile = {}
@@ -1433,13 +1440,9 @@ class EC2State(MachineState[EC2Definition], EC2CommonState):
         if update_instance_profile and (
             self.instance_profile != defn.instance_profile or check
         ):
-            assocs = self._retry(
-                lambda: self._connect_boto3().describe_iam_instance_profile_associations(
-                    Filters=[{"Name": "instance-id", "Values": [self.vm_id]}]
-                )[
-                    "IamInstanceProfileAssociations"
-                ]
-            )
+            assocs = self._connect_boto3().describe_iam_instance_profile_associations(
+                Filters=[{"Name": "instance-id", "Values": [self.vm_id]}]
+            )["IamInstanceProfileAssociations"]
             if (
                 len(assocs) > 0
                 and self.instance_profile != assocs[0]["IamInstanceProfile"]["Arn"]
@@ -1454,15 +1457,11 @@ class EC2State(MachineState[EC2Definition], EC2CommonState):
                 )
                 nixops.util.check_wait(
                     lambda: len(
-                        self._retry(
-                            lambda: self._connect_boto3().describe_iam_instance_profile_associations(
-                                Filters=[
-                                    {"Name": "instance-id", "Values": [self.vm_id]}
-                                ]
-                            )[
-                                "IamInstanceProfileAssociations"
-                            ]
-                        )
+                        self._connect_boto3().describe_iam_instance_profile_associations(
+                            Filters=[{"Name": "instance-id", "Values": [self.vm_id]}]
+                        )[
+                            "IamInstanceProfileAssociations"
+                        ]
                     )
                     == 0
                 )
@@ -1738,10 +1737,10 @@ class EC2State(MachineState[EC2Definition], EC2CommonState):
                 v["generatedKey"] = nixops.util.generate_random_string(length=256)
                 self.update_block_device_mapping(device_stored, v)
 
-    def _retry_route53(self, f, error_codes=[]):
+    def _retry_route53(self, f, error_codes=()):
         return nixops_aws.ec2_utils.retry(
             f,
-            error_codes=["Throttling", "PriorRequestNotComplete"] + error_codes,
+            error_codes=["Throttling", "PriorRequestNotComplete", *error_codes],
             logger=self,
         )
 
@@ -3,25 +3,88 @@
 import os
 import time
 import random
-import nixops.util
-import boto3
-import boto.ec2
-import boto.vpc
-from boto.exception import EC2ResponseError
-from boto.exception import SQSError
-from boto.exception import BotoServerError
-from botocore.exceptions import ClientError
-from boto.pyami.config import Config
-from typing import Tuple, TYPE_CHECKING, Iterable, Any, Optional
+import functools
+import configparser
+import threading
+from typing import Tuple, TYPE_CHECKING, Iterable, Any, Optional, Dict, Callable
 
 if TYPE_CHECKING:
+    import boto3
+    import botocore.config
     import mypy_boto3_rds
 
+# Connections and clients are expensive to set up (credential lookup,
+# endpoint resolution, TLS handshake), so they are shared per
+# (service, region, access key id) for the lifetime of the process. Like the
+# handles resources keep in self._conn, they are not refreshed when a session
+# token expires.
+_connection_cache: Dict[Tuple[str, str, Optional[str]], Any] = {}
+
+
+def _cache_connection(service: str) -> Callable[[Callable], Callable]:
+    def decorator(connect_fn):
+        @functools.wraps(connect_fn)
+        def wrapper(region, access_key_id):
+            key = (service, region, access_key_id)
+            conn = _connection_cache.get(key)
+            if conn is None:
+                conn = connect_fn(region, access_key_id)
+                _connection_cache[key] = conn
+            return conn
+
+        return wrapper
+
+    return decorator
+
+
+# Parsed credential files, keyed by path and invalidated when the file's
+# mtime changes.
+_ec2_keys_cache: Dict[str, Tuple[int, Dict[str, Tuple[str, str, None]]]] = {}
+_aws_creds_cache: Dict[str, Tuple[int, configparser.ConfigParser]] = {}
+
+
+def _parse_cached(cache: Dict[str, Tuple[int, Any]], path: str, parse) -> Any:
+    """Return parse(path), re-parsing only if the file changed; None if it is missing."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = cache.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, parse(path))
+        cache[path] = cached
+    return cached[1]
+
+
+def _parse_ec2_keys_file(path: str) -> Dict[str, Tuple[str, str, None]]:
+    """
+        Map both the access key ID and the optional alias (third column) of
+        every line in ~/.ec2-keys to its key pair. Earlier lines win.
+    """
+    keys: Dict[str, Tuple[str, str, None]] = {}
+    with open(path, "r") as f:
+        for line in f.read().splitlines():
+            line = line.split("#")[0]  # drop comments
+            w = line.split()
+            if len(w) < 2 or len(w) > 3:
+                continue
+            if len(w) == 3:
+                keys.setdefault(w[2], (w[0], w[1], None))
+            keys.setdefault(w[0], (w[0], w[1], None))
+    return keys
+
+
+def _parse_aws_credentials_file(path: str) -> configparser.ConfigParser:
+    conf = configparser.ConfigParser(interpolation=None)
+    conf.read(path)
+    return conf
+
 
 def fetch_aws_secret_key(access_key_id) -> Tuple[str, str, str]:
     """
         Fetch the secret access key corresponding to the given access key ID from ~/.ec2-keys,
-        or from ~/.aws/credentials, or from the environment (in that priority).
+        or from ~/.aws/credentials, or from the environment (in that priority). If the access key ID
+        is the one set in the environment, the environment is consulted first.
 
         If fetching from the environment, any session token which might be present due to 2FA
         will also be returned.  Using session tokens are not supported when fetching from
@@ -30,32 +93,30 @@ def fetch_aws_secret_key(access_key_id) -> Tuple[str, str, str]:
 
     def parse_ec2_keys():
         path = os.path.expanduser("~/.ec2-keys")
-        if os.path.isfile(path):
-            with open(path, "r") as f:
-                contents = f.read()
-                for line in contents.splitlines():
-                    line = line.split("#")[0]  # drop comments
-                    w = line.split()
-                    if len(w) < 2 or len(w) > 3:
-                        continue
-                    if len(w) == 3 and w[2] == access_key_id:
-                        return (w[0], w[1], None)
-                    if w[0] == access_key_id:
-                        return (access_key_id, w[1], None)
-        return None
+        keys = _parse_cached(_ec2_keys_cache, path, _parse_ec2_keys_file)
+        if keys is None:
+            return None
+        return keys.get(access_key_id)
 
     def parse_aws_credentials():
-        path = os.getenv("AWS_SHARED_CREDENTIALS_FILE", "~/.aws/credentials")
-        if not os.path.exists(os.path.expanduser(path)):
+        path = os.path.expanduser(
+            os.getenv("AWS_SHARED_CREDENTIALS_FILE", "~/.aws/credentials")
+        )
+        conf = _parse_cached(_aws_creds_cache, path, _parse_aws_credentials_file)
+        if conf is None:
             return None
 
-        conf = Config(os.path.expanduser(path))
-
-        if access_key_id == conf.get("default", "aws_access_key_id"):
-            return (access_key_id, conf.get("default", "aws_secret_access_key"), None)
+        if access_key_id == conf.get("default", "aws_access_key_id", fallback=None):
+            return (
+                access_key_id,
+                conf.get("default", "aws_secret_access_key", fallback=None),
+                None,
+            )
+        if not conf.has_section(access_key_id):
+            return None
         return (
-            conf.get(access_key_id, "aws_access_key_id"),
-            conf.get(access_key_id, "aws_secret_access_key"),
+            conf.get(access_key_id, "aws_access_key_id", fallback=None),
+            conf.get(access_key_id, "aws_secret_access_key", fallback=None),
             None,
         )
 
@@ -68,29 +129,30 @@ def fetch_aws_secret_key(access_key_id) -> Tuple[str, str, str]:
             os.environ.get("AWS_SESSION_TOKEN") or os.environ.get("AWS_SECURITY_TOKEN"),
         )
 
-    sources = (
-        get_credentials()
-        for get_credentials in [
-            parse_ec2_keys,
-            parse_aws_credentials,
-            ec2_keys_from_env,
-        ]
-    )
-    # Get the first existing access-secret key pair
-    credentials = next((keys for keys in sources if keys and keys[1]), None)
+    getters = [parse_ec2_keys, parse_aws_credentials, ec2_keys_from_env]
+    if access_key_id and access_key_id == get_access_key_id():
+        # The key itself came from the environment, so its secret most likely
+        # did too: look there first and skip reading the credential files.
+        getters = [ec2_keys_from_env, parse_ec2_keys, parse_aws_credentials]
 
-    if not credentials:
-        raise Exception(
-            "please set $EC2_SECRET_KEY or $AWS_SECRET_ACCESS_KEY, or add the key for ‘{0}’ to ~/.ec2-keys or ~/.aws/credentials".format(
-                access_key_id
-            )
-        )
+    # Return the first existing access-secret key pair
+    for get_credentials in getters:
+        credentials = get_credentials()
+        if credentials and credentials[1]:
+            return credentials
 
-    return credentials
+    raise Exception(
+        "please set $EC2_SECRET_KEY or $AWS_SECRET_ACCESS_KEY, or add the key for ‘{0}’ to ~/.ec2-keys or ~/.aws/credentials".format(
+            access_key_id
+        )
+    )
 
 
+@_cache_connection("boto.ec2")
 def connect(region, access_key_id):
     """Connect to the specified EC2 region using the given access key."""
+    import boto.ec2
+
     assert region
     (access_key_id, secret_access_key, session_token) = fetch_aws_secret_key(
         access_key_id
@@ -106,23 +168,72 @@ def connect(region, access_key_id):
     return conn
 
 
-def connect_ec2_boto3(region, access_key_id):
-    assert region
+# Building a boto3 session (config files, loaders, endpoint data) is costly,
+# so all clients are derived from one session. Credentials are passed per
+# client, so a single session can serve several access keys. Sessions are not
+# thread-safe, hence the lock around client creation.
+_boto3_session: Optional["boto3.session.Session"] = None
+# Retries botocore makes on top of the first attempt (legacy "max_attempts").
+BOTO3_MAX_RETRIES = 8
+_boto3_session_config: Optional["botocore.config.Config"] = None
+_boto3_session_lock = threading.Lock()
+
+
+def _boto3_client(service_name, region, access_key_id):
+    global _boto3_session, _boto3_session_config
+    import boto3
+    import botocore.config
+
     (access_key_id, secret_access_key, session_token) = fetch_aws_secret_key(
         access_key_id
     )
-    client = boto3.session.Session().client(
-        "ec2",
-        region_name=region,
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        aws_session_token=session_token,
-    )
-    return client
+    credentials: Dict[str, Optional[str]]
+    if (
+        access_key_id == os.environ.get("AWS_ACCESS_KEY_ID")
+        and secret_access_key == os.environ.get("AWS_SECRET_ACCESS_KEY")
+        and session_token
+        == (os.environ.get("AWS_SESSION_TOKEN") or os.environ.get("AWS_SECURITY_TOKEN"))
+    ):
+        # These are exactly what botocore's own credential chain finds in the
+        # environment, so let it resolve (and cache) them for the session.
+        credentials = {}
+    else:
+        credentials = {
+            "aws_access_key_id": access_key_id,
+            "aws_secret_access_key": secret_access_key,
+            "aws_session_token": session_token,
+        }
+
+    with _boto3_session_lock:
+        if _boto3_session is None:
+            _boto3_session = boto3.session.Session()
+            # Let botocore deal with throttling and transient errors itself;
+            # adaptive mode also rate-limits on the client side once AWS starts
+            # throttling. Resources are deployed in parallel, so allow more
+            # than the default 10 pooled HTTP connections per client.
+            _boto3_session_config = botocore.config.Config(
+                retries={"max_attempts": BOTO3_MAX_RETRIES, "mode": "adaptive"},
+                max_pool_connections=50,
+            )
+        return _boto3_session.client(
+            service_name,
+            region_name=region,
+            config=_boto3_session_config,
+            **credentials
+        )
+
+
+@_cache_connection("ec2")
+def connect_ec2_boto3(region, access_key_id):
+    assert region
+    return _boto3_client("ec2", region, access_key_id)
 
 
+@_cache_connection("boto.vpc")
 def connect_vpc(region, access_key_id):
     """Connect to the specified VPC region using the given access key."""
+    import boto.vpc
+
     assert region
     (access_key_id, secret_access_key, session_token) = fetch_aws_secret_key(
         access_key_id
@@ -138,46 +249,86 @@ def connect_vpc(region, access_key_id):
     return conn
 
 
+@_cache_connection("rds")
 def connect_rds_boto3(region, access_key_id) -> "mypy_boto3_rds.RDSClient":
     assert region
-    (access_key_id, secret_access_key, session_token) = fetch_aws_secret_key(
-        access_key_id
-    )
-    client = boto3.session.Session().client(
-        "rds",
-        region_name=region,
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key,
-        aws_session_token=session_token,
-    )
-    return client
+    return _boto3_client("rds", region, access_key_id)
 
 
 def get_access_key_id():
     return os.environ.get("EC2_ACCESS_KEY") or os.environ.get("AWS_ACCESS_KEY_ID")
 
 
+# Error codes AWS uses to signal throttling; these are retried unless botocore
+# already used up the retries of an adaptive client (see retry()).
+THROTTLING_ERROR_CODES = frozenset(
+    [
+        "Throttling",
+        "ThrottlingException",
+        "ThrottledException",
+        "RequestThrottledException",
+        "RequestLimitExceeded",
+        "RequestThrottled",
+        "TooManyRequestsException",
+        "ProvisionedThroughputExceededException",
+        "EC2ThrottledException",
+        "TransactionInProgressException",
+        "SlowDown",
+    ]
+)
+
+# Error codes that no amount of retrying will fix.
+PERMANENT_ERROR_CODES = frozenset(
+    [
+        "AuthFailure",
+        "UnauthorizedOperation",
+        "OptInRequired",
+        "InvalidClientTokenId",
+        "SignatureDoesNotMatch",
+    ]
+)
+
+RETRY_BASE_SLEEP = 1.0
+RETRY_MAX_SLEEP = 20.0
+
+
 def retry(
-    f, error_codes: Optional[Iterable[Any]] = None, logger=None, num_retries: int = 7
+    f, error_codes: Iterable[Any] = frozenset(), logger=None, num_retries: int = 7
 ):
     """
-        Retry function f up to 7 times. If error_codes argument is empty list, retry on all EC2 response errors,
-        otherwise, only on the specified error codes.
+        Retry function f up to 7 times on AWS errors. If error_codes argument is empty list, retry on all EC2 response errors,
+        otherwise, only on the specified error codes. Throttling errors are retried too, except when they come
+        from a client made by connect_ec2_boto3/connect_rds_boto3 that already used up its own adaptive
+        retries and the caller did not list the code. Errors in PERMANENT_ERROR_CODES are never retried.
     """
 
-    if error_codes is None:
-        error_codes = []
+    from boto.exception import EC2ResponseError, SQSError, BotoServerError
+    from botocore.exceptions import ClientError
+
+    # Checked on every failed attempt, so make membership tests O(1).
+    error_codes = frozenset(error_codes or ())
 
-    def handle_exception(e):
-        if hasattr(e, "error_code"):
+    def should_abort(e):
+        if isinstance(e, ClientError):
+            err_code = e.response.get("Error", {}).get("Code")
+            err_msg = e.response.get("Error", {}).get("Message")
+        else:
             err_code = e.error_code
             err_msg = e.error_message
-        else:
-            err_code = e.response["Error"]["Code"]
-            err_msg = e.response["Error"]["Message"]
 
-        if err_code == "RequestLimitExceeded":
-            return False
+        if err_code in THROTTLING_ERROR_CODES:
+            # Clients from _boto3_client have already retried this
+            # BOTO3_MAX_RETRIES times with backoff; going through that again
+            # would only prolong the throttling, unless the caller asked for it.
+            return (
+                isinstance(e, ClientError)
+                and err_code not in error_codes
+                and e.response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+                >= BOTO3_MAX_RETRIES
+            )
+
+        if err_code in PERMANENT_ERROR_CODES:
+            return True
 
         if error_codes and err_code not in error_codes:
             return True
@@ -188,54 +339,51 @@ def retry(
                     err_code, err_msg
                 )
             )
+        return False
 
-    def handle_boto3_exception(e):
-        if error_codes and getattr(e, "response", {}).get("code") not in error_codes:
-            return True
-
-        if logger is not None:
-            if hasattr(e, "response"):
-                logger.log(
-                    "got (possibly transient) EC2 error '{}', retrying...".format(
-                        str(e.response["Error"])
-                    )
-                )
-
-    def should_abort(e):
-        if isinstance(e, (SQSError, EC2ResponseError, BotoServerError)):
-            return handle_exception(e)
-        elif isinstance(e, ClientError):
-            return handle_boto3_exception(e)
-
+    # Decorrelated jitter: each sleep is drawn between the base and three
+    # times the previous sleep, capped so retries stay responsive.
+    next_sleep = RETRY_BASE_SLEEP
     i = 0
-    while i <= num_retries:
+    while True:
         i += 1
-        next_sleep = 5 + random.random() * (2 ** i)
 
+        # Anything that is not an AWS error (e.g. a bug in f) is raised
+        # immediately rather than retried.
         try:
             return f()
-        except Exception as e:
-            if num_retries == i or should_abort(e):
+        except (EC2ResponseError, SQSError, BotoServerError, ClientError) as e:
+            if i >= num_retries or should_abort(e):
                 raise e
-            num_retries += 1
 
+        next_sleep = min(
+            RETRY_MAX_SLEEP, random.uniform(RETRY_BASE_SLEEP, next_sleep * 3)
+        )
         time.sleep(next_sleep)
 
 
 def get_volume_by_id(conn, volume_id, allow_missing=False):
-    """Get volume object by volume id."""
-    try:
-        volumes = conn.get_all_volumes([volume_id])
-        if len(volumes) != 1:
-            raise Exception("unable to find volume ‘{0}’".format(volume_id))
-        return volumes[0]
-    except boto.exception.EC2ResponseError as e:
-        if e.error_code != "InvalidVolume.NotFound":
-            raise
-    return None
+    """
+        Get volume object by volume id, or None if it does not exist.
+
+        allow_missing is ignored: a missing volume always yields None, which
+        callers check for regardless of the flag.
+    """
+    # Filtering rather than asking for the id directly makes a missing volume
+    # come back as an empty list instead of an InvalidVolume.NotFound error.
+    volumes = conn.get_all_volumes(filters={"volume-id": volume_id})
+    if not volumes:
+        return None
+    if len(volumes) != 1:
+        raise Exception(
+            "volume id ‘{0}’ matched more than one volume".format(volume_id)
+        )
+    return volumes[0]
 
 
-def wait_for_volume_available(conn, volume_id, logger, states=["available"]):
+def wait_for_volume_available(
+    conn, volume_id, logger, states=["available"], timeout: int = 900
+):
     """Wait for an EBS volume to become available."""
 
     logger.log_start(
@@ -245,25 +393,73 @@ def wait_for_volume_available(conn, volume_id, logger, states=["available"]):
     def check_available():
         # Allow volume to be missing due to eventual consistency.
         volume = get_volume_by_id(conn, volume_id, allow_missing=True)
+        if volume is None:
+            logger.log_continue("[missing] ")
+            return False
         logger.log_continue("[{0}] ".format(volume.status))
         return volume.status in states
 
-    nixops.util.check_wait(check_available, max_tries=90)
+    # Volumes usually become available within seconds, so poll quickly at
+    # first and back off exponentially (with jitter) up to 30s between polls.
+    deadline = time.time() + timeout
+    delay = 1
+    while not check_available():
+        if time.time() + delay > deadline:
+            raise Exception(
+                "timed out waiting for volume ‘{0}’ to become available".format(
+                    volume_id
+                )
+            )
+        time.sleep(delay + random.random())
+        delay = min(delay * 2, 30)
 
     logger.log_end("")
 
 
+# Security group name <-> id maps per (connection, VPC), so that resolving
+# the groups of many machines costs a single DescribeSecurityGroups call.
+_security_group_cache: Dict[Tuple[Any, str], Tuple[Dict[str, str], Dict[str, str]]] = {}
+
+
+def _security_group_maps(conn, vpc_id, refresh=False):
+    key = (conn, vpc_id)
+    maps = _security_group_cache.get(key)
+    if maps is None or refresh:
+        name_to_id = {}
+        id_to_name = {}
+        # Not paginated on purpose: without MaxResults DescribeSecurityGroups
+        # returns the whole result set in one response, and the API version
+        # boto speaks predates MaxResults/NextToken for this call.
+        for sg in conn.get_all_security_groups(filters={"vpc-id": vpc_id}):
+            name_to_id[sg.name] = sg.id
+            id_to_name[sg.id] = sg.name
+        maps = (name_to_id, id_to_name)
+        _security_group_cache[key] = maps
+    return maps
+
+
+def invalidate_security_groups(vpc_id=None):
+    """Forget cached security groups of the given VPC, or of all VPCs."""
+    for key in list(_security_group_cache):
+        if vpc_id is None or key[1] == vpc_id:
+            _security_group_cache.pop(key, None)
+
+
+def _lookup_security_group(conn, vpc_id, index, value):
+    # A miss may mean the group was created after the cache was filled.
+    found = _security_group_maps(conn, vpc_id)[index].get(value)
+    if found is None:
+        found = _security_group_maps(conn, vpc_id, refresh=True)[index].get(value)
+    return found
+
+
 def name_to_security_group(conn, name, vpc_id):
     if not vpc_id or name.startswith("sg-"):
         return name
 
-    id = None
-    for sg in conn.get_all_security_groups(
-        filters={"group-name": name, "vpc-id": vpc_id}
-    ):
-        if sg.name == name:
-            id = sg.id
-            return id
+    id = _lookup_security_group(conn, vpc_id, 0, name)
+    if id is not None:
+        return id
 
     raise Exception(
         "could not resolve security group name '{0}' in VPC '{1}'".format(name, vpc_id)
@@ -271,13 +467,9 @@ def name_to_security_group(conn, name, vpc_id):
 
 
 def id_to_security_group_name(conn, sg_id, vpc_id):
-    name = None
-    for sg in conn.get_all_security_groups(
-        filters={"group-id": sg_id, "vpc-id": vpc_id}
-    ):
-        if sg.id == sg_id:
-            name = sg.name
-            return name
+    name = _lookup_security_group(conn, vpc_id, 1, sg_id)
+    if name is not None:
+        return name
     raise Exception(
         "could not resolve security group id '{0}' in VPC '{1}'".format(sg_id, vpc_id)
     )
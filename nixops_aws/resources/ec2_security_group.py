@@ -220,6 +220,7 @@ class EC2SecurityGroupState(nixops.resources.ResourceState[EC2SecurityGroupDefin
                     defn.vpc_id,
                 )
                 self.security_group_id = grp.id
+                nixops_aws.ec2_utils.invalidate_security_groups(defn.vpc_id)
                 # If group creation succeeded, the group wasn't there before,
                 # in which case also its rules must be (re-)created below.
                 security_group_was_created = True
@@ -342,6 +343,7 @@ class EC2SecurityGroupState(nixops.resources.ResourceState[EC2SecurityGroupDefin
                 conn = nixops_aws.ec2_utils.connect(region, self.access_key_id)
             try:
                 conn.delete_security_group(group["name"])
+                nixops_aws.ec2_utils.invalidate_security_groups()
             except boto.exception.EC2ResponseError as e:
                 if e.error_code != "InvalidGroup.NotFound":
                     raise
@@ -362,6 +364,7 @@ class EC2SecurityGroupState(nixops.resources.ResourceState[EC2SecurityGroupDefin
                     ),
                     error_codes=["DependencyViolation"],
                 )
+                nixops_aws.ec2_utils.invalidate_security_groups(self.vpc_id)
             except boto.exception.EC2ResponseError as e:
                 if e.error_code != "InvalidGroup.NotFound":
                     raise
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+from nixops_aws.ec2_utils import _parse_ec2_keys_file
+
+
+class TestParseEc2Keys(unittest.TestCase):
+    def parse(self, contents):
+        with tempfile.NamedTemporaryFile("w", delete=False) as f:
+            f.write(contents)
+        self.addCleanup(os.unlink, f.name)
+        return _parse_ec2_keys_file(f.name)
+
+    def test_keys_and_aliases(self):
+        keys = self.parse(
+            "AKID1 SECRET1 alias1  # a comment\n"
+            "AKID2 SECRET2\n"
+            "# AKID3 SECRET3\n"
+            "too many columns here\n"
+            "single\n"
+        )
+        self.assertEqual(keys["AKID1"], ("AKID1", "SECRET1", None))
+        self.assertEqual(keys["alias1"], ("AKID1", "SECRET1", None))
+        self.assertEqual(keys["AKID2"], ("AKID2", "SECRET2", None))
+        self.assertNotIn("AKID3", keys)
+        self.assertNotIn("too", keys)
+        self.assertNotIn("single", keys)
+
+    def test_first_match_wins(self):
+        keys = self.parse("AKID1 SECRET1 shared\nAKID2 SECRET2 shared\nAKID1 OTHER\n")
+        self.assertEqual(keys["shared"], ("AKID1", "SECRET1", None))
+        self.assertEqual(keys["AKID1"], ("AKID1", "SECRET1", None))
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from nixops_aws import ec2_utils
+from nixops_aws.ec2_utils import fetch_aws_secret_key
+
+
+class TestFetchAwsSecretKey(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.addCleanup(self.home.cleanup)
+        self.credentials = os.path.join(self.home.name, "credentials")
+        with open(self.credentials, "w") as f:
+            f.write(
+                "[default]\n"
+                "aws_access_key_id = AKENV\n"
+                "aws_secret_access_key = file-default-secret\n"
+                "[prof]\n"
+                "aws_access_key_id = AKPROF\n"
+                "aws_secret_access_key = file-prof-secret\n"
+            )
+        with open(os.path.join(self.home.name, ".ec2-keys"), "w") as f:
+            f.write("AKOTHER ec2-keys-secret other\n")
+
+        env = mock.patch.dict(
+            os.environ,
+            {
+                "HOME": self.home.name,
+                "AWS_SHARED_CREDENTIALS_FILE": self.credentials,
+                "AWS_ACCESS_KEY_ID": "AKENV",
+                "AWS_SECRET_ACCESS_KEY": "env-secret",
+                "AWS_SESSION_TOKEN": "env-token",
+            },
+            clear=True,
+        )
+        env.start()
+        self.addCleanup(env.stop)
+
+    def test_env_key_prefers_env(self):
+        self.assertEqual(
+            fetch_aws_secret_key("AKENV"), ("AKENV", "env-secret", "env-token")
+        )
+
+    def test_env_key_falls_back_to_files(self):
+        del os.environ["AWS_SECRET_ACCESS_KEY"]
+        self.assertEqual(
+            fetch_aws_secret_key("AKENV"), ("AKENV", "file-default-secret", None)
+        )
+
+    def test_other_keys_prefer_files(self):
+        self.assertEqual(
+            fetch_aws_secret_key("prof"), ("AKPROF", "file-prof-secret", None)
+        )
+        self.assertEqual(
+            fetch_aws_secret_key("other"), ("AKOTHER", "ec2-keys-secret", None)
+        )
+        self.assertEqual(
+            fetch_aws_secret_key("AKOTHER"), ("AKOTHER", "ec2-keys-secret", None)
+        )
+
+    def test_missing_profile_falls_through_to_env(self):
+        self.assertEqual(
+            fetch_aws_secret_key("nosuch"), ("nosuch", "env-secret", "env-token")
+        )
+
+    def test_no_secret_anywhere(self):
+        del os.environ["AWS_SECRET_ACCESS_KEY"]
+        with self.assertRaises(Exception):
+            fetch_aws_secret_key("nosuch")
+
+
+class TestParseCached(unittest.TestCase):
+    def setUp(self):
+        f = tempfile.NamedTemporaryFile("w", delete=False)
+        f.close()
+        self.path = f.name
+        self.addCleanup(os.unlink, self.path)
+
+    def test_reparses_only_when_mtime_changes(self):
+        cache = {}
+        parse = mock.Mock(side_effect=["first", "second"])
+
+        os.utime(self.path, ns=(1, 1))
+        self.assertEqual(ec2_utils._parse_cached(cache, self.path, parse), "first")
+        self.assertEqual(ec2_utils._parse_cached(cache, self.path, parse), "first")
+        self.assertEqual(parse.call_count, 1)
+
+        os.utime(self.path, ns=(2, 2))
+        self.assertEqual(ec2_utils._parse_cached(cache, self.path, parse), "second")
+        self.assertEqual(parse.call_count, 2)
+
+    def test_missing_file(self):
+        parse = mock.Mock()
+        self.assertIsNone(ec2_utils._parse_cached({}, self.path + ".missing", parse))
+        parse.assert_not_called()
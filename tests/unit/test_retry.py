@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+
+from boto.exception import EC2ResponseError
+from botocore.exceptions import ClientError
+
+from nixops_aws.ec2_utils import (
+    retry,
+    BOTO3_MAX_RETRIES,
+    RETRY_BASE_SLEEP,
+    RETRY_MAX_SLEEP,
+)
+
+
+def client_error(code, retry_attempts=0):
+    return ClientError(
+        {
+            "Error": {"Code": code, "Message": "dummy"},
+            "ResponseMetadata": {"RetryAttempts": retry_attempts},
+        },
+        "Dummy",
+    )
+
+
+def ec2_response_error(code):
+    e = EC2ResponseError(400, "Bad Request")
+    e.error_code = code
+    return e
+
+
+@mock.patch("nixops_aws.ec2_utils.time.sleep")
+class TestRetry(unittest.TestCase):
+    def test_gives_up_after_num_retries(self, sleep):
+        f = mock.Mock(side_effect=client_error("InvalidInstanceID.NotFound"))
+        with self.assertRaises(ClientError):
+            retry(f, num_retries=4)
+        self.assertEqual(f.call_count, 4)
+        self.assertEqual(sleep.call_count, 3)
+        for (delay,), _ in sleep.call_args_list:
+            self.assertGreaterEqual(delay, RETRY_BASE_SLEEP)
+            self.assertLessEqual(delay, RETRY_MAX_SLEEP)
+
+    def test_no_sleep_on_success(self, sleep):
+        self.assertEqual(retry(lambda: 42), 42)
+        sleep.assert_not_called()
+
+    def test_retries_only_given_error_codes(self, sleep):
+        f = mock.Mock(side_effect=[client_error("DependencyViolation"), 42])
+        self.assertEqual(retry(f, error_codes=["DependencyViolation"]), 42)
+
+        f = mock.Mock(side_effect=client_error("InvalidParameterValue"))
+        with self.assertRaises(ClientError):
+            retry(f, error_codes=["DependencyViolation"])
+        self.assertEqual(f.call_count, 1)
+
+    def test_boto_throttling_is_always_retried(self, sleep):
+        f = mock.Mock(side_effect=[ec2_response_error("RequestLimitExceeded"), 42])
+        self.assertEqual(retry(f, error_codes=["DependencyViolation"]), 42)
+
+    def test_boto3_throttling_is_retried(self, sleep):
+        # e.g. a client with botocore's default legacy retries
+        f = mock.Mock(side_effect=[client_error("Throttling", retry_attempts=4), 42])
+        self.assertEqual(retry(f), 42)
+
+    def test_exhausted_adaptive_throttling_is_not_retried_again(self, sleep):
+        error = client_error("RequestLimitExceeded", retry_attempts=BOTO3_MAX_RETRIES)
+        f = mock.Mock(side_effect=error)
+        with self.assertRaises(ClientError):
+            retry(f)
+        self.assertEqual(f.call_count, 1)
+
+        # unless the caller explicitly asks for it
+        f = mock.Mock(side_effect=[error, 42])
+        self.assertEqual(retry(f, error_codes=["RequestLimitExceeded"]), 42)
+
+    def test_permanent_errors_are_not_retried(self, sleep):
+        f = mock.Mock(side_effect=client_error("UnauthorizedOperation"))
+        with self.assertRaises(ClientError):
+            retry(f)
+        self.assertEqual(f.call_count, 1)
+
+    def test_non_aws_errors_are_not_retried(self, sleep):
+        f = mock.Mock(side_effect=TypeError("bug"))
+        with self.assertRaises(TypeError):
+            retry(f)
+        self.assertEqual(f.call_count, 1)
+        sleep.assert_not_called()
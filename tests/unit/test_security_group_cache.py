@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+from nixops_aws import ec2_utils
+
+
+def security_group(name, sg_id):
+    sg = mock.Mock(id=sg_id)
+    sg.name = name
+    return sg
+
+
+class TestSecurityGroupCache(unittest.TestCase):
+    def setUp(self):
+        ec2_utils.invalidate_security_groups()
+        self.addCleanup(ec2_utils.invalidate_security_groups)
+        self.conn = mock.Mock()
+        self.conn.get_all_security_groups.return_value = [
+            security_group("web", "sg-1"),
+            security_group("db", "sg-2"),
+        ]
+
+    def test_lookups_share_one_call(self):
+        self.assertEqual(
+            ec2_utils.name_to_security_group(self.conn, "web", "vpc-1"), "sg-1"
+        )
+        self.assertEqual(
+            ec2_utils.id_to_security_group_name(self.conn, "sg-2", "vpc-1"), "db"
+        )
+        self.conn.get_all_security_groups.assert_called_once_with(
+            filters={"vpc-id": "vpc-1"}
+        )
+
+    def test_refresh_on_miss(self):
+        ec2_utils.name_to_security_group(self.conn, "web", "vpc-1")
+        self.conn.get_all_security_groups.return_value.append(
+            security_group("cache", "sg-3")
+        )
+        self.assertEqual(
+            ec2_utils.name_to_security_group(self.conn, "cache", "vpc-1"), "sg-3"
+        )
+        self.assertEqual(self.conn.get_all_security_groups.call_count, 2)
+
+        with self.assertRaises(Exception):
+            ec2_utils.name_to_security_group(self.conn, "missing", "vpc-1")
+
+    def test_invalidate_security_groups(self):
+        ec2_utils.name_to_security_group(self.conn, "web", "vpc-1")
+        self.conn.get_all_security_groups.return_value = [security_group("web", "sg-4")]
+        self.assertEqual(
+            ec2_utils.name_to_security_group(self.conn, "web", "vpc-1"), "sg-1"
+        )
+
+        ec2_utils.invalidate_security_groups("vpc-2")
+        self.assertEqual(
+            ec2_utils.name_to_security_group(self.conn, "web", "vpc-1"), "sg-1"
+        )
+
+        ec2_utils.invalidate_security_groups("vpc-1")
+        self.assertEqual(
+            ec2_utils.name_to_security_group(self.conn, "web", "vpc-1"), "sg-4"
+        )